@@ -1,5 +1,8 @@
 from typing import List, Union, Any, Tuple
 from dataclasses import dataclass
+from contextlib import contextmanager
+import inspect
+import math
 import numpy as np
 
 import torch
@@ -7,15 +10,24 @@ from torch import Tensor
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.distributed as dist
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
 
 from .core import no_centered_cov
 from .operations import OperationContext
-from .utils import skip_param_grad
+from .utils import numba, _is_numba_available, skip_param_grad
 from .grad_maker import GradientMaker, LOSS_CROSS_ENTROPY, LOSS_MSE
 from .matrices import *
 from .vector import ParamVector, reduce_vectors
 from .mvp import power_method, stochastic_lanczos_quadrature, conjugate_gradient_method, quadratic_form
-from .symmatrix import SymMatrix
+from .symmatrix import batched_update_inv
+
+try:
+    from torch.distributed.distributed_c10d import _coalescing_manager
+    # the async_ops argument was introduced in PyTorch 2.1
+    if 'async_ops' not in inspect.signature(_coalescing_manager).parameters:
+        _coalescing_manager = None
+except ImportError:
+    _coalescing_manager = None
 
 __all__ = [
     'FisherConfig',
@@ -182,13 +194,10 @@ class FisherMaker(GradientMaker):
     def replace_fisher_with_inv(self, damping):
         model = self.model
         attr = self.config.fisher_attr
-        for module in model.modules():
-            fisher: SymMatrix = getattr(module, attr, None)
-            if fisher is not None:
-                fisher.update_inv(damping=damping, replace=True)
-        fisher: SymMatrix = getattr(model, attr, None)
-        if fisher is not None:
-            fisher.update_inv(damping=damping, replace=True)
+        fishers = [getattr(module, attr, None) for module in model.modules()]
+        # layers with the same matrix sizes are inverted in one batched call
+        # (model itself is included in model.modules() for the full Fisher)
+        batched_update_inv([fisher for fisher in fishers if fisher is not None], damping=damping, replace=True)
 
     def _fisher_loop(self, closure):
         raise NotImplementedError
@@ -210,6 +219,14 @@ class FisherMaker(GradientMaker):
                               with_grad=False,
                               group: dist.ProcessGroup = None,
                               async_op=False):
+        """
+        Reduce-scatter the Fisher tensors so that the rank-th process receives the sum
+        over all processes of the tensors of module_partitions[rank].
+
+        With async_op=True, the collectives are issued without waiting and the returned handles
+        have to be waited (handle.wait()) before the Fisher tensors (and grads) are read,
+        so that the communication can be overlapped with other computation.
+        """
         if not dist.is_initialized():
             raise EnvironmentError('torch.distributed is not initialized.')
         if not torch.cuda.is_available():
@@ -242,10 +259,36 @@ class FisherMaker(GradientMaker):
             raise ValueError(f'Number of tensors in every partition has to be {num_tensors_per_partition}. '
                              f'Got {[len(tensor_partitions[i]) for i in range(world_size)]}')
         handles = []
-        for i in range(num_tensors_per_partition):
-            input_list = [tensor_list[i] for tensor_list in tensor_partitions]
-            output = input_list[dist.get_rank(group)]
-            handles.append(dist.reduce_scatter(output, input_list, group=group, async_op=async_op))
+        if num_tensors_per_partition == 0:
+            return handles
+        rank = dist.get_rank(group)
+        # pack the i-th tensors of all partitions into one flat buffer per (dtype, device)
+        # when every partition has the same total size
+        buckets = []
+        for indices in _bucket_indices(tensor_partitions[0]):
+            numels = [sum(tensor_list[i].numel() for i in indices) for tensor_list in tensor_partitions]
+            if any(numel != numels[0] for numel in numels):
+                # uneven partitions: one collective per tensor (no flat copies)
+                for i in indices:
+                    input_list = [tensor_list[i] for tensor_list in tensor_partitions]
+                    handles.append(dist.reduce_scatter(input_list[rank], input_list,
+                                                       group=group, async_op=async_op))
+                continue
+            input_list = [_flatten_dense_tensors([tensor_list[i] for i in indices])
+                          for tensor_list in tensor_partitions]
+            buckets.append(([tensor_partitions[rank][i] for i in indices], input_list))
+        device = tensor_partitions[0][0].device
+        with _coalescing(group, device=device, async_op=async_op, enabled=len(buckets) > 1) as cm:
+            for _, input_list in buckets:
+                handle = dist.reduce_scatter(input_list[rank], input_list, group=group, async_op=async_op)
+                if cm is None:
+                    handles.append(handle)
+        if cm is not None and async_op:
+            handles.append(cm)
+        buckets = [(tensors, input_list[rank]) for tensors, input_list in buckets]
+        if async_op:
+            return [_UnflattenHandle(handles, buckets)]
+        _unflatten_buckets(buckets)
         return handles
 
     def reduce_fisher(self,
@@ -256,6 +299,12 @@ class FisherMaker(GradientMaker):
                       dst=0,
                       group: dist.ProcessGroup = None,
                       async_op=False):
+        """
+        All-reduce (or reduce to dst) the Fisher tensors of modules.
+
+        With async_op=True, the returned handles have to be waited (handle.wait())
+        before the Fisher tensors (and grads) are read.
+        """
         if not dist.is_initialized():
             raise ValueError('torch.distributed is not initialized.')
         tensor_list = []
@@ -269,11 +318,31 @@ class FisherMaker(GradientMaker):
                     if p.requires_grad and p.grad is not None:
                         tensor_list.append(p.grad)
         handles = []
-        for tensor in tensor_list:
-            if all_reduce:
-                handles.append(dist.all_reduce(tensor, group=group, async_op=async_op))
-            else:
-                handles.append(dist.reduce(tensor, dst=dst, group=group, async_op=async_op))
+        if len(tensor_list) == 0:
+            return handles
+        # pack the tensors into one flat buffer per (dtype, device)
+        buckets = []
+        for indices in _bucket_indices(tensor_list):
+            tensors = [tensor_list[i] for i in indices]
+            buckets.append((tensors, _flatten_dense_tensors(tensors)))
+        # buckets of different dtypes/devices can only be coalesced by NCCL
+        enabled = len(buckets) > 1 and dist.get_backend(group) == dist.Backend.NCCL
+        device = None if all_reduce else tensor_list[0].device
+        with _coalescing(group, device=device, async_op=async_op, enabled=enabled) as cm:
+            for _, flat in buckets:
+                if all_reduce:
+                    handle = dist.all_reduce(flat, group=group, async_op=async_op)
+                else:
+                    handle = dist.reduce(flat, dst=dst, group=group, async_op=async_op)
+                if cm is None:
+                    handles.append(handle)
+        if cm is not None and async_op:
+            handles.append(cm)
+        if not all_reduce and dist.get_rank() != dst:
+            buckets = []  # only dst receives the reduced values
+        if async_op:
+            return [_UnflattenHandle(handles, buckets)]
+        _unflatten_buckets(buckets)
         return handles
 
     def reduce_fvp(self, fisher_shape, is_master=True, all_reduce=False):
@@ -368,13 +437,7 @@ class FisherMaker(GradientMaker):
 
         grids = np.linspace(range_min, range_max, num=num_bins)
 
-        density_output = np.zeros((n_v, num_bins))
-
-        for i in range(n_v):
-            for j in range(num_bins):
-                x = grids[j]
-                tmp_result = np.exp(-(x - eigvals[i, :])**2 / (2.0 * sigma_squared)) / np.sqrt(2 * np.pi * sigma_squared)
-                density_output[i, j] = np.sum(tmp_result * weights[i, :])
+        density_output = _gaussian_kde(grids, eigvals, weights, sigma_squared)
         density = np.mean(density_output, axis=0)
         normalization = np.sum(density) * (grids[1] - grids[0])
         density = density / normalization
@@ -391,8 +454,7 @@ class FisherMaker(GradientMaker):
                     random_seed=None
                     ) -> ParamVector:
         if b is None:
-            grads = {p: p.grad for p in self.model.parameters() if p.requires_grad}
-            b = ParamVector(grads.keys(), grads.values())
+            b = self._get_grad_vector()
 
         # for making MC samplings at each iteration deterministic
         if self.config.fisher_type == FISHER_MC and random_seed is None:
@@ -408,14 +470,103 @@ class FisherMaker(GradientMaker):
                                          print_progress=print_progress,
                                          random_seed=random_seed)
 
+    def _get_grad_vector(self) -> ParamVector:
+        # filtered on every call so that changes of requires_grad (e.g., freezing) are reflected
+        params = [p for p in self.model.parameters() if p.requires_grad]
+        return ParamVector(params, [p.grad for p in params])
+
     def fisher_quadratic_form(self, vec: ParamVector = None):
         if vec is None:
-            grads = {p: p.grad for p in self.model.parameters() if p.requires_grad}
-            vec = ParamVector(grads.keys(), grads.values())
+            vec = self._get_grad_vector()
 
         return quadratic_form(self._get_fvp_fn(), vec)
 
 
+def _bucket_indices(tensor_list: List[Tensor]) -> List[List[int]]:
+    buckets = {}
+    for i, tensor in enumerate(tensor_list):
+        buckets.setdefault((tensor.dtype, tensor.device), []).append(i)
+    return list(buckets.values())
+
+
+def _unflatten_buckets(buckets: List[Tuple[List[Tensor], Tensor]]):
+    for tensors, flat in buckets:
+        for tensor, synced in zip(tensors, _unflatten_dense_tensors(flat, tensors)):
+            tensor.copy_(synced)
+
+
+class _UnflattenHandle:
+    """
+    Handle for an async collective on flat buffers.
+    The results are copied back to the original tensors on wait().
+    """
+    def __init__(self, handles, buckets: List[Tuple[List[Tensor], Tensor]]):
+        self._handles = handles
+        self._buckets = buckets
+
+    def wait(self):
+        for handle in self._handles:
+            handle.wait()
+        _unflatten_buckets(self._buckets)
+        self._buckets = []
+        return True
+
+
+@contextmanager
+def _coalescing(group: dist.ProcessGroup = None, device=None, async_op=False, enabled=True):
+    """
+    Coalesce the collectives issued inside the context into a single NCCL group call.
+    Yields None (and issues the collectives one by one) if coalescing is not available.
+    With async_op=True, the yielded manager has to be waited instead of the individual handles.
+    """
+    if not enabled or _coalescing_manager is None:
+        yield None
+        return
+    with _coalescing_manager(group, device=device, async_ops=async_op) as cm:
+        yield cm
+
+
+if _is_numba_available:
+    @numba.njit(parallel=True, fastmath=True)
+    def _gaussian_kde_numba(grids, eigvals, weights, sigma_squared):
+        n_v, num_iter = eigvals.shape
+        num_bins = grids.shape[0]
+        norm = math.sqrt(2 * math.pi * sigma_squared)
+        density_output = np.empty((n_v, num_bins))
+        for i in numba.prange(n_v):
+            for j in range(num_bins):
+                s = 0.
+                for k in range(num_iter):
+                    d = grids[j] - eigvals[i, k]
+                    s += weights[i, k] * math.exp(-d * d / (2.0 * sigma_squared))
+                density_output[i, j] = s / norm
+        return density_output
+
+
+def _gaussian_kde(grids, eigvals, weights, sigma_squared, chunk_size=512):
+    """
+    density[i, j] = sum_k weights[i, k] * N(grids[j] | eigvals[i, k], sigma_squared)
+
+    Uses a Numba kernel (no n_v x num_bins x num_iter temporary) if available.
+    Otherwise, the grid axis is processed in chunks of chunk_size to bound
+    the (n_v, chunk_size, num_iter) temporary.
+    """
+    if _is_numba_available:
+        return _gaussian_kde_numba(np.ascontiguousarray(grids, dtype=np.float64),
+                                   np.ascontiguousarray(eigvals, dtype=np.float64),
+                                   np.ascontiguousarray(weights, dtype=np.float64),
+                                   float(sigma_squared))
+    n_v, num_bins = eigvals.shape[0], grids.shape[0]
+    density_output = np.empty((n_v, num_bins))
+    for start in range(0, num_bins, chunk_size):
+        end = min(start + chunk_size, num_bins)
+        diff = grids[None, start:end, None] - eigvals[:, None, :]  # n_v x chunk x num_iter
+        kernel = np.exp(-diff ** 2 / (2.0 * sigma_squared))
+        density_output[:, start:end] = (kernel * weights[:, None, :]).sum(axis=-1)
+    density_output /= np.sqrt(2 * np.pi * sigma_squared)
+    return density_output
+
+
 class FisherExactCrossEntropy(FisherMaker):
     @property
     def do_local_accumulate(self) -> bool:
@@ -425,18 +576,25 @@ class FisherExactCrossEntropy(FisherMaker):
 
     def _fisher_loop(self, closure):
         logits = self._logits
-        log_probs = F.log_softmax(logits, dim=-1)
-        log_probs = log_probs.view(-1, log_probs.size(-1))
-        n, n_classes = log_probs.shape
+        logits = logits.reshape(-1, logits.size(-1))
+        n_classes = logits.size(-1)
         with torch.no_grad():
-            probs = F.softmax(logits, dim=-1)
-            sqrt_probs = torch.sqrt(probs)
+            log_probs = F.log_softmax(logits, dim=-1)
+            probs = log_probs.exp()
+            # sqrt(softmax(x)) = exp(0.5 * log_softmax(x)), which does not underflow to 0 for tiny probs
+            sqrt_probs = log_probs.mul_(0.5).exp_()
         for i in range(n_classes):
-            targets = torch.tensor([i] * n, device=logits.device)
+            if i == self.config.ignore_index:
+                # F.nll_loss would give zero loss for every sample
+                continue
 
             def nll_expr():
-                nll = F.nll_loss(log_probs, targets, reduction='none', ignore_index=self.config.ignore_index)
-                return nll.mul(sqrt_probs[:, i]).sum()
+                # -log_probs[:, i].mul(sqrt_probs[:, i]).sum() has the gradient
+                # sqrt_probs[:, i] * (probs - e_i) w.r.t. logits, which is given here in closed form
+                # so that the backward pass of each class does not go through log_softmax
+                grad_logits = probs.mul(sqrt_probs[:, i:i + 1])
+                grad_logits[:, i] -= sqrt_probs[:, i]
+                return logits.mul(grad_logits).sum()
             closure(nll_expr, retain_graph=i < n_classes - 1)
 
 
@@ -448,14 +606,18 @@ class FisherMCCrossEntropy(FisherMaker):
     def _fisher_loop(self, closure):
         logits = self._logits
         n_mc_samples = self.config.n_mc_samples
-        probs = F.softmax(logits, dim=-1)
         log_probs = F.log_softmax(logits, dim=-1)
+        with torch.no_grad():
+            probs = log_probs.exp()  # avoids another softmax over logits
         dist = torch.distributions.Categorical(probs)
+        flat_log_probs = log_probs.view(-1, log_probs.size(-1))
+        with torch.no_grad():
+            # draw every MC sample up front in a single sampling call
+            all_targets = dist.sample((n_mc_samples,)).view(n_mc_samples, -1)
         for i in range(n_mc_samples):
-            with torch.no_grad():
-                targets = dist.sample()
-            closure(lambda: F.nll_loss(log_probs.view(-1, log_probs.size(-1)),
-                                       targets.view(-1), reduction='sum', ignore_index=self.config.ignore_index) / n_mc_samples,
+            targets = all_targets[i]
+            closure(lambda: F.nll_loss(flat_log_probs, targets,
+                                       reduction='sum', ignore_index=self.config.ignore_index) / n_mc_samples,
                     retain_graph=i < n_mc_samples - 1)
 
 
@@ -469,6 +631,7 @@ class FisherExactMSE(FisherMaker):
     def _fisher_loop(self, closure):
         logits = self._logits
         n_dims = logits.size(-1)
+        logits = logits.reshape(-1, n_dims)  # flatten all dimensions but the output dimension
         for i in range(n_dims):
             closure(lambda: logits[:, i].sum(), retain_graph=i < n_dims - 1)
 
@@ -481,11 +644,12 @@ class FisherMCMSE(FisherMaker):
     def _fisher_loop(self, closure):
         logits = self._logits
         n_mc_samples = self.config.n_mc_samples
-        var = self.config.var
-        dist = torch.distributions.normal.Normal(logits, scale=np.sqrt(var))
+        std = math.sqrt(self.config.var)
+        targets = torch.empty_like(logits)
         for i in range(n_mc_samples):
             with torch.no_grad():
-                targets = dist.sample()
+                # sample from N(logits, var) into the same buffer
+                targets.normal_(mean=0, std=std).add_(logits)
             closure(lambda: 0.5 * F.mse_loss(logits, targets, reduction='sum') / n_mc_samples,
                     retain_graph=i < n_mc_samples - 1)
 
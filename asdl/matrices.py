@@ -245,9 +245,8 @@ class MatrixManager:
                 stats = getattr(module, stats_attr, None)
                 if stats is None:
                     continue
-                vec.extend(stats.to_vector())
+                vec.append(stats.to_vector())
 
-        vec = [v.flatten() for v in vec]
         return torch.cat(vec)
 
     def vector_to_matrices(self, vec, stats_name):
@@ -356,8 +355,9 @@ class MatrixManager:
 
     def get_top_eigenvalue(self, matrix_type, matrix_shape, stats_name=None):
         def reduce(val1, val2):
-            val1 = max(val1, val2)
-            return val1
+            if not isinstance(val2, torch.Tensor):
+                return val1  # -1 of an empty Diag (the result is clamped to -1 below)
+            return val2 if val1 is None else torch.maximum(val1, val2)
 
         rst = self._collect_metrics(
             matrix_type,
@@ -365,9 +365,9 @@ class MatrixManager:
             stats_name,
             metrics_fn='top_eigenvalue',
             reduce_fn=reduce,
-            init=-1
+            init=None
         )
-        return rst
+        return -1 if rst is None else max(rst.item(), -1)
 
     def get_trace(self, matrix_type, matrix_shape, stats_name=None):
         def reduce(val1, val2):
@@ -382,7 +382,8 @@ class MatrixManager:
             reduce_fn=reduce,
             init=0
         )
-        return rst
+        # reduced on device; a single host sync at the end
+        return rst.item() if isinstance(rst, torch.Tensor) else rst
 
     def get_effective_dim(
         self, matrix_type, matrix_shape, reg, stats_name=None
@@ -180,7 +180,8 @@ def conjugate_gradient_method(mvp_fn: Callable[[ParamVector], ParamVector],
         p = r.copy()
         last_rz = r.dot(r)
     else:
-        p = preconditioner.precondition(r)
+        # copy: p is updated in-place, and precondition(r) may return r itself
+        p = preconditioner.precondition(r).copy()
         last_rz = r.dot(p)
 
     b_norm = b.norm()
@@ -204,7 +205,7 @@ def conjugate_gradient_method(mvp_fn: Callable[[ParamVector], ParamVector],
             rz = r.dot(z)
 
         beta = rz / last_rz  # Fletcher-Reeves
-        p = z.add(p, beta)
+        p.mul_(beta).add_(z)  # p = z + beta * p (in-place)
         last_rz = rz
 
     return x
@@ -3,7 +3,7 @@ from typing import Dict, List, Tuple
 import torch
 import torch.nn as nn
 from torch.cuda import nvtx
-from ..utils import original_requires_grad, cholesky_inv, smw_inv
+from ..utils import original_requires_grad, cholesky_inv, unit_wise_inv, smw_inv
 from ..matrices import *
 from ..symmatrix import *
 from ..vector import ParamVector
@@ -115,12 +115,16 @@ class Operation:
         self._sketching_size = 256
         self._truncated_rank = None
 
-    def accumulate_result(self, value, *keys, extend=False):
+    def accumulate_result(self, value, *keys, extend=False, scale=1.):
         """
         Examples:
              accumulate_result(data, OP_COV_UNIT_WISE)
              accumulate_result(data, OP_BATCH_GRADS, 'weight')
              accumulate_result(A, OP_COV_KRON, 'A')
+             accumulate_result(A, OP_COV_KRON, 'A', scale=cov_scale)  # accumulates cov_scale * A
+
+        A scaled value is stored as is (scaled in-place) if there is no result yet,
+        otherwise it is added to the result by a single add_ (no separate pass for scaling).
         """
         results = self._op_results
         if len(keys) > 1:
@@ -130,9 +134,13 @@ class Operation:
                 results = results[key]
         key = keys[-1]
         if results.get(key, None) is None:
+            if scale != 1:
+                value.mul_(scale)
             results[key] = value
         elif extend:
             results[key].extend(value)
+        elif scale != 1:
+            results[key].add_(value, alpha=scale)
         else:
             results[key] += value
 
@@ -197,11 +205,11 @@ class Operation:
             if op_name not in FWD_OPS:
                 continue
             if op_name == OP_COV_KRON:
-                A = self.cov_kron_A(module, in_data).mul_(cov_scale)
-                self.accumulate_result(A, OP_COV_KRON, 'A')
+                A = self.cov_kron_A(module, in_data)
+                self.accumulate_result(A, OP_COV_KRON, 'A', scale=cov_scale)
             elif op_name == OP_COV_SWIFT_KRON:
-                A = self.cov_swift_kron_A(module, in_data).mul_(cov_scale)
-                self.accumulate_result(A, OP_COV_KRON, 'A')  # not OP_COV_SWIFT_KRON
+                A = self.cov_swift_kron_A(module, in_data)
+                self.accumulate_result(A, OP_COV_KRON, 'A', scale=cov_scale)  # not OP_COV_SWIFT_KRON
             elif op_name == OP_RFIM_RELU:
                 self.accumulate_result(self.rfim_relu(module, in_data, out_data), OP_RFIM_RELU)
             elif op_name == OP_RFIM_SOFTMAX:
@@ -239,11 +247,11 @@ class Operation:
                 continue
             if op_name in [OP_COV, OP_COV_INV]:
                 _, _, batch_g = self.collect_batch_grads(in_data, out_grads)
-                cov = torch.matmul(batch_g.T, batch_g).mul_(cov_scale)
+                cov = torch.matmul(batch_g.T, batch_g)
                 if op_name == OP_COV:
-                    self.accumulate_result(cov, OP_COV, 'data')
+                    self.accumulate_result(cov, OP_COV, 'data', scale=cov_scale)
                 else:
-                    self.accumulate_result(cholesky_inv(cov, damping), OP_COV, 'inv')
+                    self.accumulate_result(cholesky_inv(cov.mul_(cov_scale), damping), OP_COV, 'inv')
             elif op_name == OP_CVP:
                 _, _, batch_g = self.collect_batch_grads(in_data, out_grads)
                 if vector is None:
@@ -262,8 +270,8 @@ class Operation:
                 else:
                     self.accumulate_result(cvp.view_as(module.bias), OP_CVP, 'bias')
             elif op_name == OP_COV_KRON:
-                B = self.cov_kron_B(module, out_grads).mul_(cov_scale)
-                self.accumulate_result(B, OP_COV_KRON, 'B')
+                B = self.cov_kron_B(module, out_grads)
+                self.accumulate_result(B, OP_COV_KRON, 'B', scale=cov_scale)
             elif op_name == OP_COV_KRON_INV:
                 A = self.cov_kron_A(module, in_data).mul_(cov_scale)
                 del in_data
@@ -277,8 +285,8 @@ class Operation:
                 self.accumulate_result(A_inv, OP_COV_KRON, 'A_inv')
                 self.accumulate_result(B_inv, OP_COV_KRON, 'B_inv')
             elif op_name == OP_COV_SWIFT_KRON:
-                B = self.cov_swift_kron_B(module, out_grads).mul_(cov_scale)
-                self.accumulate_result(B, OP_COV_KRON, 'B')  # not OP_COV_SWIFT_KRON
+                B = self.cov_swift_kron_B(module, out_grads)
+                self.accumulate_result(B, OP_COV_KRON, 'B', scale=cov_scale)  # not OP_COV_SWIFT_KRON
             elif op_name == OP_COV_SWIFT_KRON_INV:
                 A = self.cov_swift_kron_A(module, in_data)
                 del in_data
@@ -311,27 +319,25 @@ class Operation:
                         raise ValueError(f'Both weight and bias have to require grad for {OP_COV_UNIT_WISE} (module: {module}).')
                 elif original_requires_grad(module, 'bias'):
                     in_data = self.extend_in_data(in_data)
-                cov = self.cov_unit_wise(module, in_data, out_grads).mul_(cov_scale)
+                cov = self.cov_unit_wise(module, in_data, out_grads)
                 if op_name == OP_COV_UNIT_WISE:
-                    self.accumulate_result(cov, OP_COV_UNIT_WISE, 'data')
+                    self.accumulate_result(cov, OP_COV_UNIT_WISE, 'data', scale=cov_scale)
                 else:
-                    diag = torch.diagonal(cov, dim1=1, dim2=2)
-                    diag += damping
-                    inv = torch.inverse(cov)
+                    inv = unit_wise_inv(cov.mul_(cov_scale), damping)
                     self.accumulate_result(inv, OP_COV_UNIT_WISE, 'inv')
             elif op_name in [OP_COV_DIAG, OP_COV_DIAG_INV]:
                 if original_requires_grad(module, 'weight'):
-                    cov = self.cov_diag_weight(module, in_data, out_grads).mul_(cov_scale)
+                    cov = self.cov_diag_weight(module, in_data, out_grads)
                     if op_name == OP_COV_DIAG:
-                        self.accumulate_result(cov, OP_COV_DIAG, 'weight')
+                        self.accumulate_result(cov, OP_COV_DIAG, 'weight', scale=cov_scale)
                     else:
-                        self.accumulate_result(1/(cov+damping), OP_COV_DIAG, 'weight_inv')
+                        self.accumulate_result(1/(cov.mul_(cov_scale)+damping), OP_COV_DIAG, 'weight_inv')
                 if original_requires_grad(module, 'bias'):
-                    cov = self.cov_diag_bias(module, out_grads).mul_(cov_scale)
+                    cov = self.cov_diag_bias(module, out_grads)
                     if op_name == OP_COV_DIAG:
-                        self.accumulate_result(cov, OP_COV_DIAG, 'bias')
+                        self.accumulate_result(cov, OP_COV_DIAG, 'bias', scale=cov_scale)
                     else:
-                        self.accumulate_result(1/(cov+damping), OP_COV_DIAG, 'bias_inv')
+                        self.accumulate_result(1/(cov.mul_(cov_scale)+damping), OP_COV_DIAG, 'bias_inv')
             elif op_name == OP_GRAM_HADAMARD:
                 if self._model_for_kernel is None:
                     raise ValueError(f'model_for_kernel needs to be set for {OP_GRAM_HADAMARD}.')
@@ -601,8 +607,8 @@ class OperationContext:
         except KeyError:
             return default
 
-    def accumulate_result(self, module, value, *keys):
-        return self.get_operation(module).accumulate_result(value, *keys)
+    def accumulate_result(self, module, value, *keys, scale=1.):
+        return self.get_operation(module).accumulate_result(value, *keys, scale=scale)
 
     def clear_result(self, module, *keys):
         return self.get_operation(module).clear_result(*keys)
@@ -693,11 +699,11 @@ class OperationContext:
         bg = self.full_batch_grads(module)
         if bg is None:
             return
-        cov = torch.matmul(bg.T, bg).mul_(scale)  # p x p
+        cov = torch.matmul(bg.T, bg)  # p x p
         if calc_inv:
-            self.accumulate_result(module, cholesky_inv(cov, damping), OP_FULL_COV, 'inv')
+            self.accumulate_result(module, cholesky_inv(cov.mul_(scale), damping), OP_FULL_COV, 'inv')
         else:
-            self.accumulate_result(module, cov, OP_FULL_COV, 'data')
+            self.accumulate_result(module, cov, OP_FULL_COV, 'data', scale=scale)
 
     def full_cvp(self, module):
         return self.get_result(module, OP_FULL_CVP)
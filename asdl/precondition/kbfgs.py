@@ -1,4 +1,5 @@
 import math
+from typing import Dict, Tuple
 
 import torch
 import torch.nn as nn
@@ -7,13 +8,15 @@ from torch import Tensor
 from ..core import extend
 from ..operations import OP_MEAN_INPUTS, OP_SPATIAL_MEAN_OUTPUTS, OP_SPATIAL_MEAN_OUTGRADS,\
     OP_OUT_SPATIAL_SIZE, OP_COV_KRON, OP_BFGS_KRON_S_AS, OperationContext
-from ..utils import cholesky_inv
+from ..utils import cholesky_inv, get_buffer
 from ..symmatrix import SymMatrix
 from .prec_grad_maker import PreconditionedGradientMaker, PreconditioningConfig
 
 
 __all__ = ['KronBfgsGradientMaker']
 
+_DEBUG_BFGS = False  # if True, bfgs_inv_update_ checks the symmetry of H
+
 
 class KronBfgsGradientMaker(PreconditionedGradientMaker):
     r"""GradientMaker for calculating the preconditioned gradient by `K-BFGS <https://arxiv.org/abs/2006.08877>`_.
@@ -41,6 +44,8 @@ class KronBfgsGradientMaker(PreconditionedGradientMaker):
         self.mu1 = mu1
         self.mean_outputs_attr = 'mean_outputs'
         self.mean_outgrads_attr = 'mean_outgrads'
+        self._eye_cache: Dict[Tuple[int, torch.device, torch.dtype], Tensor] = {}
+        self._workspaces: Dict[Tuple[nn.Module, bool], Dict[str, Tensor]] = {}
 
     def do_forward_and_backward(self, step=None):
         return not self.do_update_preconditioner(step)
@@ -108,6 +113,7 @@ class KronBfgsGradientMaker(PreconditionedGradientMaker):
 
     def _update_A_inv(self, cxt: OperationContext):
         config = self.config
+        updates = []
         for module in self.module_dict.values():
             damping = self._get_damping(cxt, module, is_A=True)
             bfgs = getattr(module, self.bfgs_attr, None)
@@ -115,15 +121,14 @@ class KronBfgsGradientMaker(PreconditionedGradientMaker):
                 s, As = cxt.bfgs_kron_s_As(module)
                 y = As + damping * s
             else:
-                new_bfgs = cxt.cov_symmatrix(module, pop=True).mul_(1/config.data_size)
+                new_bfgs = cxt.cov_symmatrix(module, pop=True)
                 if bfgs is None:
-                    setattr(module, self.bfgs_attr, new_bfgs)
+                    setattr(module, self.bfgs_attr, new_bfgs.mul_(1/config.data_size))
                     bfgs = new_bfgs
                 else:
                     # update the exponential moving average (EMA) of A
-                    new_bfgs.mul_(config.ema_decay)
-                    bfgs.mul_(1 - config.ema_decay)
-                    bfgs += new_bfgs  # this must be __iadd__ to preserve inv
+                    # (this must be in-place to preserve inv)
+                    bfgs.mul_(1 - config.ema_decay).add_(new_bfgs, alpha=config.ema_decay / config.data_size)
                 A = bfgs.kron.A
                 if bfgs.kron.A_inv is None:
                     bfgs.kron.A_inv = cholesky_inv(A, damping)
@@ -133,7 +138,14 @@ class KronBfgsGradientMaker(PreconditionedGradientMaker):
             if bfgs is None:
                 raise ValueError(f'Matrix for {module} is not calculated yet.')
             H = bfgs.kron.A_inv
-            bfgs_inv_update_(H, s, y)
+            updates.append((H, s, y, self._get_workspace(module, is_A=True)))
+        for group in _group_by_shape(updates):
+            if len(group) == 1:
+                H, s, y, workspace = group[0]
+                bfgs_inv_update_(H, s, y, workspace=workspace)
+            else:
+                Hs, ss, ys, _ = zip(*group)
+                _batched_update_(Hs, bfgs_inv_update_batched_, ss, ys)
         self._A_inv_exists = True
 
     def _store_mean(self, cxt: OperationContext, is_forward=True):
@@ -144,19 +156,42 @@ class KronBfgsGradientMaker(PreconditionedGradientMaker):
                 setattr(module, self.mean_outgrads_attr, cxt.spatial_mean_out_grads(module))
 
     def _update_B_inv(self, cxt: OperationContext):
+        updates = []
         for module in self.module_dict.values():
             damping = self._get_damping(cxt, module, is_A=False)
             bfgs = getattr(module, self.bfgs_attr)
             s = cxt.spatial_mean_out_data(module) - getattr(module, self.mean_outputs_attr)
             y = cxt.spatial_mean_out_grads(module) - getattr(module, self.mean_outgrads_attr)
             if bfgs.kron.B_inv is None:
-                bfgs.kron.B_inv = torch.eye(s.shape[-1], device=s.device)
+                bfgs.kron.B_inv = self._get_eye(s.shape[-1], s.device, s.dtype).clone()
             H = bfgs.kron.B_inv
             if isinstance(module, nn.Conv2d):
                 s = s.mean(dim=0)
                 y = y.mean(dim=0)
-            powell_lm_damping_(H, s, y, mu1=self.mu1, mu2=damping)
-            bfgs_inv_update_(H, s, y)
+            updates.append((H, s, y, damping, self._get_workspace(module, is_A=False)))
+        for group in _group_by_shape(updates):
+            if len(group) == 1:
+                H, s, y, damping, workspace = group[0]
+                powell_lm_damping_(H, s, y, mu1=self.mu1, mu2=damping, workspace=workspace)
+                bfgs_inv_update_(H, s, y, workspace=workspace)
+            else:
+                Hs, ss, ys, dampings, _ = zip(*group)
+
+                def update_(H, s, y):
+                    mu2 = torch.tensor(dampings, device=H.device, dtype=H.dtype)
+                    powell_lm_damping_batched_(H, s, y, mu1=self.mu1, mu2=mu2)
+                    bfgs_inv_update_batched_(H, s, y)
+                _batched_update_(Hs, update_, ss, ys)
+
+    def _get_workspace(self, module: nn.Module, is_A=True) -> Dict[str, Tensor]:
+        # buffers for the BFGS updates of A (or B) of this module (allocated lazily by bfgs_inv_update_)
+        return self._workspaces.setdefault((module, is_A), {})
+
+    def _get_eye(self, n: int, device: torch.device, dtype: torch.dtype) -> Tensor:
+        key = (n, device, dtype)
+        if key not in self._eye_cache:
+            self._eye_cache[key] = torch.eye(n, device=device, dtype=dtype)
+        return self._eye_cache[key]
 
     def _get_damping(self, cxt: OperationContext, module: nn.Module, is_A=True):
         damping = self.config.damping
@@ -174,44 +209,133 @@ class KronBfgsGradientMaker(PreconditionedGradientMaker):
             return sqrt_damping
 
 
-def powell_lm_damping_(H: Tensor, s: Tensor, y: Tensor, mu1: float, mu2: float):
+def powell_lm_damping_(H: Tensor, s: Tensor, y: Tensor, mu1: float, mu2: float,
+                       workspace: Dict[str, Tensor] = None):
+    """
+    workspace (optional): a dict to keep the d-dimensional buffers across calls.
+    """
     if mu1 <= 0 or 1 <= mu1:
         raise ValueError(f'mu1 has to be in (0, 1). Got {mu1}.')
     if mu2 <= 0:
         raise ValueError(f'mu2 has to be > 0. Got {mu2}.')
-    Hy = torch.mv(H, y)
+    _powell_lm_damping_(H, s, y, mu1, mu2, get_buffer(workspace, 'Hy', s.shape, s))
+
+
+@torch.jit.script
+def _powell_lm_damping_(H, s, y, mu1, mu2, Hy):
+    # type: (Tensor, Tensor, Tensor, float, float, Tensor) -> None
+    """
+    theta is selected by torch.where (instead of a Python branch)
+    to avoid a device-to-host sync, and the pointwise ops are fused by TorchScript.
+    Hy is a buffer for H @ y.
+    """
+    torch.mv(H, y, out=Hy)
     ytHy = torch.dot(y, Hy)
     sty = torch.dot(s, y)
-    if sty < mu1 * ytHy:
-        theta = (1 - mu1) * ytHy / (ytHy - sty)
-    else:
-        theta = 1
-    s.mul_(theta).sub_(Hy, alpha=1 - theta)  # Powell's damping on H
+    theta = torch.where(sty < mu1 * ytHy, (1 - mu1) * ytHy / (ytHy - sty), torch.ones_like(sty))
+    s.mul_(theta).addcmul_(Hy, 1 - theta)  # Powell's damping on H
     y.add_(s, alpha=mu2)  # Levenberg-Marquardt damping on H^{-1}
 
 
-def bfgs_inv_update_(H: Tensor, s: Tensor, y: Tensor):
+def bfgs_inv_update_(H: Tensor, s: Tensor, y: Tensor, workspace: Dict[str, Tensor] = None):
     """
     The update of H=B^{-1} in BFGS by using the Sherman-Morrison formula explained in
     https://en.wikipedia.org/wiki/Broyden%E2%80%93Fletcher%E2%80%93Goldfarb%E2%80%93Shanno_algorithm
+
+    workspace (optional): a dict to keep the d-dimensional buffers across calls.
     """
     msg = f'H has to be a {Tensor} containing a symmetric matrix.'
-    H = (H+H.T)/2
-    if H.ndim != 2 or torch.any(H.T != H):
+    if H.ndim != 2:
         raise ValueError(msg)
     d1, d2 = H.shape
     if d1 != d2:
         raise ValueError(msg)
+    if _DEBUG_BFGS and not torch.allclose(H, H.T):
+        # O(d^2) check, only for debugging
+        raise ValueError(msg)
     msg = f' has to be a {Tensor} containing a vector of same dimension as H.'
     if s.ndim != 1 or s.shape[0] != d1:
         raise ValueError('s' + msg)
     if y.ndim != 1 or y.shape[0] != d1:
-        raise ValueError('s' + msg)
+        raise ValueError('y' + msg)
+
+    _bfgs_inv_update_(H, s, y,
+                      get_buffer(workspace, 'Hy', s.shape, s), get_buffer(workspace, 'u', s.shape, s))
+
 
+@torch.jit.script
+def _bfgs_inv_update_(H, s, y, Hy, u):
+    # type: (Tensor, Tensor, Tensor, Tensor, Tensor) -> None
+    """
+    The scalars are kept as tensors (no device-to-host sync) and folded into the vectors
+    so that the rank-2 update is two rank-1 updates (BLAS ger) directly on H without d x d temporaries.
+    Hy and u are d-dimensional buffers.
+    """
     sty = torch.dot(s, y)  # s^ty
-    Hy = torch.mv(H, y)  # Hy
-    Hyst = torch.outer(Hy, s)  # Hys^t
+    torch.mv(H, y, out=Hy)  # Hy
     ytHy = torch.dot(y, Hy)  # y^tHy
-    sst = torch.outer(s, s)  # ss^t
-    H.add_(sst.mul_(sty + ytHy).div_(sty ** 2))
-    H.sub_((Hyst + Hyst.T) / sty)
+    Hy.div_(sty)  # Hy / s^ty
+    # H += ((s^ty + y^tHy) s / (s^ty)^2 - Hy / s^ty) s^t - s (Hy / s^ty)^t
+    torch.mul(s, (sty + ytHy) / sty ** 2, out=u).sub_(Hy)
+    H.addr_(u, s)
+    H.addr_(s, Hy, alpha=-1.)
+
+
+def _group_by_shape(updates):
+    """
+    Group (H, s, y, ...) tuples by the shape, dtype, and device of H
+    so that each group can be updated by batched kernels.
+    """
+    groups = {}
+    for update in updates:
+        H = update[0]
+        groups.setdefault((H.shape, H.dtype, H.device), []).append(update)
+    return list(groups.values())
+
+
+def _batched_update_(Hs, update_fn, ss, ys):
+    H = torch.stack(Hs)
+    s = torch.stack(ss)
+    y = torch.stack(ys)
+    update_fn(H, s, y)
+    if hasattr(torch, '_foreach_copy_'):
+        torch._foreach_copy_(list(Hs), list(H.unbind(0)))
+    else:
+        for dst, src in zip(Hs, H):
+            dst.copy_(src)
+
+
+def powell_lm_damping_batched_(H: Tensor, s: Tensor, y: Tensor, mu1: float, mu2: Tensor):
+    """
+    Batched version of powell_lm_damping_ for H (b x d x d), s (b x d), y (b x d), and mu2 (b).
+    """
+    if mu1 <= 0 or 1 <= mu1:
+        raise ValueError(f'mu1 has to be in (0, 1). Got {mu1}.')
+    if torch.any(mu2 <= 0):
+        raise ValueError(f'mu2 has to be > 0. Got {mu2}.')
+    Hy = torch.bmm(H, y.unsqueeze(-1)).squeeze(-1)
+    ytHy = (y * Hy).sum(dim=-1)
+    sty = (s * y).sum(dim=-1)
+    theta = torch.where(sty < mu1 * ytHy, (1 - mu1) * ytHy / (ytHy - sty), torch.ones_like(sty))
+    theta = theta.unsqueeze(-1)
+    s.mul_(theta).addcmul_(Hy, 1 - theta)  # Powell's damping on H
+    y.add_(s * mu2.unsqueeze(-1))  # Levenberg-Marquardt damping on H^{-1}
+
+
+def bfgs_inv_update_batched_(H: Tensor, s: Tensor, y: Tensor):
+    """
+    Batched version of bfgs_inv_update_ for H (b x d x d), s (b x d), and y (b x d).
+    """
+    if H.ndim != 3 or H.shape[-1] != H.shape[-2]:
+        raise ValueError(f'H has to be a {Tensor} containing a batch of symmetric matrices.')
+    if s.shape != H.shape[:-1] or y.shape != H.shape[:-1]:
+        raise ValueError(f's and y have to be {Tensor}s containing a batch of vectors of same dimension as H.')
+
+    sty = (s * y).sum(dim=-1, keepdim=True)  # s^ty
+    Hy = torch.bmm(H, y.unsqueeze(-1)).squeeze(-1)  # Hy
+    ytHy = (y * Hy).sum(dim=-1, keepdim=True)  # y^tHy
+    # H += ((s^ty + y^tHy) s / (s^ty)^2 - Hy / s^ty) s^t - s (Hy / s^ty)^t
+    Hy_sty = Hy / sty
+    left = torch.stack([s * (sty + ytHy) / sty ** 2 - Hy_sty, s], dim=-1)  # b x d x 2
+    right = torch.stack([s, -Hy_sty], dim=-2)  # b x 2 x d
+    H.baddbmm_(left, right)
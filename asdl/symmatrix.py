@@ -1,13 +1,28 @@
 import os
-from typing import Tuple, Iterable
-from operator import iadd
+import heapq
+import math
+import weakref
+from functools import lru_cache
+from typing import Dict, List, Tuple, Iterable
+from collections import defaultdict
 
 import numpy as np
 import torch
 from torch import Tensor
-from .utils import cholesky_inv, smw_inv
+from .utils import numba, _is_numba_available, get_buffer, check_cholesky_info, damped_cholesky, cholesky_inv, unit_wise_inv, smw_inv
 from .vector import ParamVector
 
+try:
+    from math import isqrt as _isqrt
+except ImportError:  # Python < 3.8
+    def _isqrt(n: int) -> int:
+        x = int(math.sqrt(n))
+        while x * x > n:
+            x -= 1
+        while (x + 1) * (x + 1) <= n:
+            x += 1
+        return x
+
 __all__ = [
     'matrix_to_tril',
     'tril_to_matrix',
@@ -16,12 +31,44 @@ __all__ = [
     'Kron',
     'KFE',
     'Diag',
-    'UnitWise'
+    'UnitWise',
+    'batched_update_inv'
 ]
 
 _default_damping = 1e-5
 
 
+if _is_numba_available:
+    @numba.njit(parallel=True, cache=True)
+    def _pack_tril_numba(mat, out):
+        n = mat.shape[0]
+        for i in numba.prange(n):
+            base = i * (i + 1) // 2
+            for j in range(i + 1):
+                out[base + j] = mat[i, j]
+
+    @numba.njit(parallel=True, cache=True)
+    def _unpack_tril_numba(tril, out):
+        n = out.shape[0]
+        for i in numba.prange(n):
+            base = i * (i + 1) // 2
+            for j in range(i + 1):
+                out[i, j] = tril[base + j]
+                out[j, i] = tril[base + j]
+
+
+def _use_numba(tensor: torch.Tensor):
+    # CPU-only fast path (zero-copy through .numpy()); the GPU path uses cached tril indices
+    return _is_numba_available and tensor.device.type == 'cpu' \
+        and tensor.dtype in (torch.float32, torch.float64) and not tensor.requires_grad
+
+
+@lru_cache(maxsize=None)
+def _tril_indices(n_rows: int, n_cols: int, device: torch.device):
+    # built once per (shape, device) and shared by save/load of every block
+    return torch.tril_indices(n_rows, n_cols, device=device).unbind(0)
+
+
 def matrix_to_tril(mat: torch.Tensor):
     """
     Convert matrix (2D array)
@@ -34,8 +81,13 @@ def matrix_to_tril(mat: torch.Tensor):
     """
     if mat.ndim != 2:
         raise ValueError(f'mat.ndim has to be 2. Got {mat.ndim}.')
-    tril_indices = torch.tril_indices(*mat.shape)
-    return mat[tril_indices[0], tril_indices[1]]
+    n_rows, n_cols = mat.shape
+    if n_rows == n_cols and _use_numba(mat):
+        out = torch.empty(n_rows * (n_rows + 1) // 2, dtype=mat.dtype)
+        _pack_tril_numba(mat.contiguous().numpy(), out.numpy())
+        return out
+    rows, cols = _tril_indices(n_rows, n_cols, mat.device)
+    return mat[rows, cols]
 
 
 def tril_to_matrix(tril: torch.Tensor):
@@ -51,10 +103,15 @@ def tril_to_matrix(tril: torch.Tensor):
     if tril.ndim != 1:
         raise ValueError(f'tril.ndim has to be 1. Got {tril.ndim}.')
     n_cols = get_n_cols_by_tril(tril)
+    if _use_numba(tril):
+        rst = torch.empty(n_cols, n_cols, dtype=tril.dtype)
+        _unpack_tril_numba(tril.contiguous().numpy(), rst.numpy())
+        return rst
     rst = torch.zeros(n_cols, n_cols, device=tril.device, dtype=tril.dtype)
-    tril_indices = torch.tril_indices(n_cols, n_cols)
-    rst[tril_indices[0], tril_indices[1]] = tril
-    rst = rst + rst.T - torch.diag(torch.diag(rst))
+    rows, cols = _tril_indices(n_cols, n_cols, tril.device)
+    # write both triangles directly (no n x n temporary for symmetrization)
+    rst[rows, cols] = tril
+    rst[cols, rows] = tril
     return rst
 
 
@@ -68,23 +125,68 @@ def get_n_cols_by_tril(tril: torch.Tensor):
     if tril.ndim != 1:
         raise ValueError(f'tril.ndim has to be 1. Got {tril.ndim}.')
     numel = tril.numel()
-    return int(np.sqrt(2 * numel + 0.25) - 0.5)
+    return (_isqrt(8 * numel + 1) - 1) // 2
 
 
 def symeig(A: torch.Tensor, upper=True):
     return torch.linalg.eigvalsh(A, UPLO='U' if upper else 'L')
 
 
+def _eigvalsh_2x2(data: torch.Tensor):
+    """
+    Closed-form eigenvalues of a batch of symmetric 2x2 matrices (f, 2, 2)
+    (upper triangle is used, as in symeig). Returns (f, 2) in ascending order.
+    """
+    a = data[..., 0, 0]
+    b = data[..., 0, 1]
+    d = data[..., 1, 1]
+    half_tr = (a + d) / 2
+    disc = torch.hypot((a - d) / 2, b)
+    return torch.stack([half_tr - disc, half_tr + disc], dim=-1)
+
+
+def _to_host(tensor):
+    """
+    Start copying tensor to a float32 host tensor (non-blocking into pinned memory for CUDA).
+    No copy is made for a float32 CPU tensor. Call _wait_host(tensors) before reading.
+    """
+    tensor = tensor.detach()
+    if tensor.is_cuda:
+        buf = torch.empty(tensor.shape, dtype=torch.float32, pin_memory=True)
+        buf.copy_(tensor, non_blocking=True)
+        return buf
+    return tensor.to(torch.float32)
+
+
+def _wait_host(tensors):
+    devices = {t.device for t in tensors if t.is_cuda}
+    for device in devices:
+        torch.cuda.current_stream(device).synchronize()
+
+
 def _save_as_numpy(path, tensor):
     dirname = os.path.dirname(path)
-    if not os.path.isdir(dirname):
-        os.makedirs(dirname)
-    np.save(path, tensor.cpu().numpy().astype('float32'))
+    os.makedirs(dirname, exist_ok=True)
+    if tensor.is_cuda or tensor.dtype != torch.float32:
+        tensor = tensor.to('cpu', torch.float32)
+    np.save(path, tensor.detach().numpy())
 
 
 def _load_from_numpy(path, device='cpu'):
-    data = np.load(path)
-    return torch.from_numpy(data).to(device)
+    # memory-mapped read: pages are copied straight into the destination host buffer
+    data = np.load(path, mmap_mode='r')
+    if torch.device(device).type == 'cuda':
+        # pinned staging + async H2D, so the next file is read while this one is transferred
+        dtype = torch.from_numpy(np.empty(0, dtype=data.dtype)).dtype
+        buf = torch.empty(data.shape, dtype=dtype, pin_memory=True)
+        buf.numpy()[...] = data
+        return buf.to(device, non_blocking=True)
+    return torch.from_numpy(np.array(data)).to(device)
+
+
+def _to_scalar(value: Tensor, as_scalar=False):
+    # a 0-dim tensor stays on device; .item() forces a host sync
+    return value.item() if as_scalar else value
 
 
 def is_all_none(xs: Iterable):
@@ -165,31 +267,64 @@ class SymMatrix:
     def has_unit(self):
         return self.unit is not None
 
-    def __add__(self, other):
-        # NOTE: inv will not be preserved
+    def _combine(self, other, inplace=False):
         values = {}
         for attr in ['data', 'kron', 'kfe', 'diag', 'unit']:
             self_value = getattr(self, attr)
             other_value = getattr(other, attr)
-            if other_value is not None:
-                if self_value is not None:
-                    value = self_value + other_value
-                else:
-                    value = other_value
-            else:
+            if other_value is None:
+                value = self_value
+            elif self_value is None:
+                value = other_value
+            elif inplace:
+                self_value += other_value
                 value = self_value
+            else:
+                value = self_value + other_value
             values[attr] = value
-
+        if inplace:
+            for attr, value in values.items():
+                setattr(self, attr, value)
+            return self
         return SymMatrix(**values)
 
+    def __add__(self, other):
+        # NOTE: inv will not be preserved
+        return self._combine(other)
+
     def __iadd__(self, other):
+        return self._combine(other, inplace=True)
+
+    def add_out(self, other, out):
+        """
+        out = self + other, written into the existing tensors of out
+        (data, kron, diag, and unit of self, other, and out have to match).
+        """
+        dsts = out._components()
+        srcs1 = self._components()
+        srcs2 = other._components()
+        if not len(dsts) == len(srcs1) == len(srcs2):
+            raise ValueError('self, other, and out have to have the same fields.')
+        for dst, src1, src2 in zip(dsts, srcs1, srcs2):
+            if not dst.shape == src1.shape == src2.shape:
+                raise ValueError(f'Shapes do not match: {dst.shape}, {src1.shape}, {src2.shape}.')
+            torch.add(src1, src2, out=dst)
+        return out
+
+    def add_(self, other, alpha=1):
+        """
+        self += alpha * other in one pass over each tensor (inv is preserved).
+        NOTE: fields that self does not have are taken from other (scaled by alpha in-place).
+        """
         for attr in ['data', 'kron', 'kfe', 'diag', 'unit']:
             self_value = getattr(self, attr)
             other_value = getattr(other, attr)
             if other_value is not None:
                 if self_value is not None:
-                    iadd(self_value, other_value)
+                    self_value.add_(other_value, alpha=alpha)
                 else:
+                    if alpha != 1:
+                        other_value.mul_(alpha)
                     setattr(self, attr, other_value)
         return self
 
@@ -212,16 +347,16 @@ class SymMatrix:
         eig = symeig(self.data)
         return torch.sort(eig, descending=True)[0]
 
-    def top_eigenvalue(self):
+    def top_eigenvalue(self, as_scalar=False):
         if not self.has_data:
             raise ValueError('data do not exist.')
         eig = symeig(self.data)
-        return eig.max().item()
+        return _to_scalar(eig.max(), as_scalar)
 
-    def trace(self):
+    def trace(self, as_scalar=False):
         if not self.has_data:
             raise ValueError('data do not exist.')
-        return torch.diag(self.data).sum().item()
+        return _to_scalar(self.data.diagonal().sum(), as_scalar)
 
     def save(self, root, relative_dir):
         relative_paths = {}
@@ -268,37 +403,37 @@ class SymMatrix:
                 self.unit = UnitWise()
             self.unit.load(path=unit_path, device=device)
 
-    def to_vector(self):
-        vec = []
-        if self.has_data:
-            vec.append(self.data)
-        if self.has_kron:
-            vec.extend(self.kron.data)
-        if self.has_diag:
-            vec.extend(self.diag.data)
-        if self.has_unit:
-            vec.extend(self.unit.data)
-
-        vec = [v.flatten() for v in vec]
-        return vec
-
-    def to_matrices(self, vec, pointer):
-        def unflatten(mat, p):
-            numel = mat.numel()
-            mat.copy_(vec[p:p + numel].view_as(mat))
-            p += numel
-            return p
-
+    def _components(self):
+        components = []
         if self.has_data:
-            pointer = unflatten(self.data, pointer)
+            components.append(self.data)
         if self.has_kron:
-            pointer = self.kron.to_matrices(unflatten, pointer)
+            components.extend([d for d in self.kron.data if d is not None])
         if self.has_diag:
-            pointer = self.diag.to_matrices(unflatten, pointer)
-        if self.has_unit:
-            pointer = self.unit.to_matrices(unflatten, pointer)
+            components.extend(self.diag.data)
+        if self.has_unit and self.unit.has_data:
+            components.append(self.unit.data)
+        return components
 
-        return pointer
+    def to_vector(self):
+        components = self._components()
+        if len(components) == 0:
+            return torch.zeros(0)
+        return torch.cat([c.reshape(-1) for c in components])
+
+    def to_matrices(self, vec, pointer=0):
+        components = self._components()
+        sizes = [c.numel() for c in components]
+        numel = sum(sizes)
+        if numel == 0:
+            return pointer
+        chunks = [chunk.view_as(c) for c, chunk in zip(components, vec[pointer:pointer + numel].split(sizes))]
+        if hasattr(torch, '_foreach_copy_'):
+            torch._foreach_copy_(components, chunks)
+        else:
+            for dst, src in zip(components, chunks):
+                dst.copy_(src)
+        return pointer + numel
 
     def update_inv(self, damping=_default_damping, replace=False):
         if self.has_data and not torch.all(self.data == 0):
@@ -317,6 +452,9 @@ class SymMatrix:
             vec_weight: torch.Tensor = None, vec_bias: torch.Tensor = None,
             use_inv=False, inplace=False):
         mat = self.inv if use_inv else self.data
+        if mat is None and self.has_kron:
+            # Kronecker-factored: (A⊗B)vec(X) = vec(B X A^T) without forming A⊗B
+            return self._kron_mvp(vectors, vec_weight, vec_bias, use_inv=use_inv, inplace=inplace)
 
         # full
         if vectors is not None:
@@ -357,6 +495,31 @@ class SymMatrix:
                 vec_bias.copy_(mvp_b)
             return [mvp_b]
 
+    def _kron_mvp(self, vectors: ParamVector = None,
+                  vec_weight: torch.Tensor = None, vec_bias: torch.Tensor = None,
+                  use_inv=False, inplace=False):
+        if vectors is not None:
+            # match the entries to weight (ndim > 1) and bias (ndim == 1) by parameter
+            params = list(vectors.params())
+            if not 1 <= len(params) <= 2:
+                raise ValueError(f'vectors has to have 1 (weight) or 2 (weight and bias) entries '
+                                 f'for Kronecker-factored mvp. Got {len(params)}.')
+            weights = [p for p in params if p.ndim > 1]
+            biases = [p for p in params if p.ndim == 1]
+            if len(weights) != 1 or len(biases) != len(params) - 1:
+                raise ValueError(f'vectors has to have one weight (ndim > 1) and at most one bias (ndim == 1) '
+                                 f'for Kronecker-factored mvp. Got shapes {[tuple(p.shape) for p in params]}.')
+            vec_weight = vectors.get_vector_by_param(weights[0])
+            vec_bias = vectors.get_vector_by_param(biases[0]) if biases else None
+        if vec_weight is None:
+            raise ValueError('vec_weight has to be set for Kronecker-factored mvp.')
+        rst = self.kron.mvp(vec_weight, vec_bias, use_inv=use_inv, inplace=inplace)
+        rst = list(rst) if vec_bias is not None else [rst]
+        if vectors is not None:
+            mvps = dict(zip(weights + biases, rst))
+            return ParamVector(params, [mvps[p] for p in params])
+        return rst
+
 
 class Kron:
     def __init__(self, A, B, A_inv=None, B_inv=None):
@@ -364,7 +527,10 @@ class Kron:
         self.B = B
         self.A_inv = A_inv
         self.B_inv = B_inv
+        self.L_A = self.L_B = None  # Cholesky factors of the damped A and B
         self._A_dim = self._B_dim = None
+        self._eig_cache = {}
+        self._buffers: Dict[str, Tensor] = {}  # reused by mvp
 
     def __add__(self, other):
         # NOTE: inv will not be preserved
@@ -381,18 +547,21 @@ class Kron:
         return Kron(A, B)
 
     def __iadd__(self, other):
+        return self.add_(other)
+
+    def add_(self, other, alpha=1):
         if not other.has_data:
             return self
         if other.has_A:
             if self.has_A:
-                self.A.add_(other.A)
+                self.A.add_(other.A, alpha=alpha)
             else:
-                self.A = other.A
+                self.A = other.A if alpha == 1 else other.A.mul_(alpha)
         if other.has_B:
             if self.has_B:
-                self.B.add_(other.B)
+                self.B.add_(other.B, alpha=alpha)
             else:
-                self.B = other.B
+                self.B = other.B if alpha == 1 else other.B.mul_(alpha)
         return self
 
     @property
@@ -452,29 +621,61 @@ class Kron:
             self.B.mul_(value)
         return self
 
-    def eigenvalues(self):
-        eig_A = symeig(self.A)
-        eig_B = symeig(self.B)
-        eig = torch.ger(eig_A, eig_B).flatten()
-        return torch.sort(eig, descending=True)[0]
-
-    def top_eigenvalue(self):
-        eig_A = symeig(self.A)
-        eig_B = symeig(self.B)
-        return (eig_A.max() * eig_B.max()).item()
+    def _symeig(self, name):
+        # cached per factor until it is rebound (identity) or modified in-place (_version)
+        mat = getattr(self, name)
+        cached = self._eig_cache.get(name)
+        if cached is None or cached[0]() is not mat or cached[1] != mat._version:
+            cached = (weakref.ref(mat), mat._version, symeig(mat))
+            self._eig_cache[name] = cached
+        return cached[2]
 
-    def trace(self):
-        trace_A = torch.diag(self.A).sum().item()
-        trace_B = torch.diag(self.B).sum().item()
-        return trace_A * trace_B
+    def eigenvalues(self):
+        eig_A = self._symeig('A')
+        eig_B = self._symeig('B')
+        eig = torch.outer(eig_A, eig_B).flatten()
+        return torch.sort(eig, descending=True, stable=False)[0]
+
+    def top_eigenvalue(self, as_scalar=False):
+        eig_A = self._symeig('A')
+        eig_B = self._symeig('B')
+        return _to_scalar(eig_A.max() * eig_B.max(), as_scalar)
+
+    def top_k_eigenvalues(self, k):
+        """
+        Top-k eigenvalues of A⊗B (pairwise products of the eigenvalues of A and B)
+        without materializing all A_dim * B_dim of them.
+        NOTE: A and B are assumed to be positive semi-definite.
+        """
+        eig_A = self._symeig('A')
+        eig_B = self._symeig('B')
+        eig_A_list = torch.sort(eig_A, descending=True)[0].tolist()
+        eig_B_list = torch.sort(eig_B, descending=True)[0].tolist()
+        k = min(k, len(eig_A_list) * len(eig_B_list))
+        heap = [(-eig_A_list[0] * eig_B_list[0], 0, 0)]
+        visited = {(0, 0)}
+        top_k = []
+        while len(top_k) < k:
+            neg_eig, i, j = heapq.heappop(heap)
+            top_k.append(-neg_eig)
+            for ni, nj in [(i + 1, j), (i, j + 1)]:
+                if ni < len(eig_A_list) and nj < len(eig_B_list) and (ni, nj) not in visited:
+                    visited.add((ni, nj))
+                    heapq.heappush(heap, (-eig_A_list[ni] * eig_B_list[nj], ni, nj))
+        return torch.tensor(top_k, device=eig_A.device, dtype=eig_A.dtype)
+
+    def trace(self, as_scalar=False):
+        trace_A = self.A.diagonal().sum()
+        trace_B = self.B.diagonal().sum()
+        return _to_scalar(trace_A * trace_B, as_scalar)
 
     def save(self, root, relative_dir):
         relative_paths = {}
-        for name in ['A', 'B']:
-            mat = getattr(self, name, None)
-            if mat is None:
-                continue
-            tril = matrix_to_tril(mat)
+        # issue the device-to-host copies of A and B before waiting on either
+        trils = {name: _to_host(matrix_to_tril(getattr(self, name)))
+                 for name in ['A', 'B'] if getattr(self, name, None) is not None}
+        _wait_host([getattr(self, name) for name in trils])
+        for name, tril in trils.items():
             tril_name = f'{name}_tril'
             relative_path = os.path.join(
                 relative_dir, 'kron', f'{tril_name}.npy'
@@ -491,14 +692,8 @@ class Kron:
         B_tril = _load_from_numpy(B_path, device)
         self.B = tril_to_matrix(B_tril)
 
-    def to_matrices(self, unflatten, pointer):
-        pointer = unflatten(self.A, pointer)
-        pointer = unflatten(self.B, pointer)
-        return pointer
-
-    def update_inv(self, damping=_default_damping, calc_A_inv=True, calc_B_inv=True, eps=1e-7, replace=False):
-        if not self.has_data:
-            raise ValueError('data do not exist.')
+    def get_damping(self, damping=_default_damping, eps=1e-7):
+        # split damping between A and B by pi = sqrt((tr(A)/A_dim) / (tr(B)/B_dim))
         damping_A = damping_B = damping
         if self.has_A and self.has_B:
             A_eig_mean = (self.A.trace() if self.A_is_square else torch.sum(self.A ** 2)) / self.A_dim
@@ -508,14 +703,26 @@ class Kron:
                 r = damping**0.5
                 damping_A = max(r * pi, eps)
                 damping_B = max(r / pi, eps)
-
+        return damping_A, damping_B
+
+    def update_inv(self, damping=_default_damping, calc_A_inv=True, calc_B_inv=True, eps=1e-7, replace=False,
+                   keep_cholesky=False):
+        """
+        keep_cholesky: if True, the Cholesky factors of the damped (square) A and B
+        are kept as L_A and L_B (for cholesky_solve).
+        """
+        if not self.has_data:
+            raise ValueError('data do not exist.')
+        damping_A, damping_B = self.get_damping(damping, eps)
 
         if calc_A_inv:
             if not self.has_A:
                 raise ValueError('A does not exist.')
             if not torch.all(self.A == 0):
                 if self.A_is_square:
-                    self.A_inv = cholesky_inv(self.A, damping_A)
+                    L_A = damped_cholesky(self.A, damping_A)
+                    self.A_inv = torch.cholesky_inverse(L_A)
+                    self.L_A = L_A if keep_cholesky else None
                 else:
                     self.A_inv = smw_inv(self.A, damping_A)
                 if replace:
@@ -526,7 +733,9 @@ class Kron:
                 raise ValueError('B does not exist.')
             if not torch.all(self.B == 0):
                 if self.B_is_square:
-                    self.B_inv = cholesky_inv(self.B, damping_B)
+                    L_B = damped_cholesky(self.B, damping_B)
+                    self.B_inv = torch.cholesky_inverse(L_B)
+                    self.L_B = L_B if keep_cholesky else None
                 else:
                     self.B_inv = smw_inv(self.B, damping_B)
                 if replace:
@@ -537,16 +746,39 @@ class Kron:
         mat_A = self.A_inv if use_inv else self.A
         mat_B = self.B_inv if use_inv else self.B
         vec_weight_2d = vec_weight.view(self.B_dim, -1)
-        mvp_w = mat_B.mm(vec_weight_2d).mm(mat_A).view_as(vec_weight)
         if inplace:
-            vec_weight.copy_(mvp_w)
+            # the result is copied into vec_weight, so the output buffer can be reused across calls
+            buf = get_buffer(self._buffers, 'mvp_w', vec_weight_2d.shape, vec_weight)
+            vec_weight.copy_(torch.linalg.multi_dot([mat_B, vec_weight_2d, mat_A], out=buf).view_as(vec_weight))
+            mvp_w = vec_weight  # not buf, which is overwritten by the next call
+        else:
+            mvp_w = torch.linalg.multi_dot([mat_B, vec_weight_2d, mat_A]).view_as(vec_weight)
         if vec_bias is not None:
             mvp_b = mat_B.mv(vec_bias)
             if inplace:
                 vec_bias.copy_(mvp_b)
+                mvp_b = vec_bias
             return mvp_w, mvp_b
         return mvp_w
 
+    def cholesky_solve(self, vec_weight, vec_bias=None):
+        """
+        Solve ((A + damping_A * I)⊗(B + damping_B * I)) x = vec with the Cholesky factors
+        kept by update_inv(keep_cholesky=True), where damping_A and damping_B are the
+        factor dampings selected by update_inv (see get_damping),
+        i.e., x = vec((B + damping_B * I)^{-1} X (A + damping_A * I)^{-1}),
+        without forming the Kronecker product.
+        """
+        if self.L_A is None or self.L_B is None:
+            raise ValueError('Cholesky factors do not exist. Call update_inv(keep_cholesky=True) first.')
+        vec_weight_2d = vec_weight.view(self.B_dim, -1)
+        sol_2d = torch.cholesky_solve(vec_weight_2d, self.L_B)
+        sol_w = torch.cholesky_solve(sol_2d.T, self.L_A).T.reshape_as(vec_weight)
+        if vec_bias is not None:
+            sol_b = torch.cholesky_solve(vec_bias.unsqueeze(-1), self.L_B).squeeze(-1)
+            return sol_w, sol_b
+        return sol_w
+
 
 class KFE:
     def __init__(self, Ua: Tensor, Ub: Tensor, scale: Tuple[Tensor]):
@@ -578,14 +810,19 @@ class KFE:
         raise NotImplementedError
 
     def __iadd__(self, other):
-        # NOTE: iadd only scale
+        return self.add_(other)
+
+    def add_(self, other, alpha=1):
+        # NOTE: add only scale
         if not other.has_scale:
             return self
         if self.has_scale:
             for i in range(len(self.scale)):
-                self.scale[i].add_(other.scale[i])
+                self.scale[i].add_(other.scale[i], alpha=alpha)
         else:
             self.scale = other.scale
+            if alpha != 1:
+                self.mul_(alpha)
         return self
 
     def mul_(self, value):
@@ -621,6 +858,7 @@ class UnitWise:
         else:
             self.data = data
         self.inv = inv
+        self._buffers: Dict[str, Tensor] = {}  # reused by mvp
 
     def __add__(self, other):
         # NOTE: inv will not be preserved
@@ -633,12 +871,15 @@ class UnitWise:
         return UnitWise(data=data)
 
     def __iadd__(self, other):
+        return self.add_(other)
+
+    def add_(self, other, alpha=1):
         if not other.has_data:
             return self
         if self.has_data:
-            self.data.add_(other.data)
+            self.data.add_(other.data, alpha=alpha)
         else:
-            self.data = other.data
+            self.data = other.data if alpha == 1 else other.data.mul_(alpha)
         return self
 
     @property
@@ -654,20 +895,26 @@ class UnitWise:
             self.data.mul_(value)
         return self
 
+    def _eigvalsh(self):
+        if self.data.shape[-1] == 2:
+            return _eigvalsh_2x2(self.data)
+        return symeig(self.data)  # batched over blocks
+
     def eigenvalues(self):
         if not self.has_data:
             raise ValueError('data do not exist.')
-        eig = [symeig(block) for block in self.data]
-        eig = torch.cat(eig)
+        eig = self._eigvalsh().flatten()
         return torch.sort(eig, descending=True)[0]
 
-    def top_eigenvalue(self):
-        top = max([symeig(block).max().item() for block in self.data])
-        return top
+    def top_eigenvalue(self, as_scalar=False):
+        if not self.has_data:
+            raise ValueError('data do not exist.')
+        return _to_scalar(self._eigvalsh().max(), as_scalar)
 
-    def trace(self):
-        trace = sum([torch.trace(block).item() for block in self.data])
-        return trace
+    def trace(self, as_scalar=False):
+        if not self.has_data:
+            raise ValueError('data do not exist.')
+        return _to_scalar(torch.diagonal(self.data, dim1=-2, dim2=-1).sum(), as_scalar)
 
     def save(self, root, relative_dir):
         relative_path = os.path.join(relative_dir, 'unit_wise.npy')
@@ -679,20 +926,12 @@ class UnitWise:
         if path:
             self.data = _load_from_numpy(path, device)
 
-    def to_matrices(self, unflatten, pointer):
-        if self.has_data:
-            pointer = unflatten(self.data, pointer)
-        return pointer
-
     def update_inv(self, damping=_default_damping, replace=False):
         if not self.has_data:
             raise ValueError('data do not exist.')
         data = self.data
         if not torch.all(data == 0):
-            diag = torch.diagonal(data, dim1=1, dim2=2)
-            diag += damping
-            self.inv = torch.inverse(data)
-            diag -= damping
+            self.inv = unit_wise_inv(data, damping)
             if replace:
                 del self.data
                 self.data = None
@@ -700,22 +939,28 @@ class UnitWise:
     def mvp(self, vec_weight, vec_bias, use_inv=False, inplace=False):
         mat = self.inv if use_inv else self.data  # (f, 2, 2) or (f_out, f_in+1, f_in+1)
         if vec_weight.shape == vec_bias.shape and mat.ndim == 3 and mat.shape[-1] == mat.shape[-2]:
-            # for BatchNormNd and LayerNorm
-            v = torch.stack([vec_weight, vec_bias], dim=1)  # (f, 2)
-            v = v.unsqueeze(2)  # (f, 2, 1)
-            mvp_wb = torch.matmul(mat, v).squeeze(2)  # (f, 2)
-            mvp_w = mvp_wb[:, 0]
-            mvp_b = mvp_wb[:, 1]
+            # for BatchNormNd and LayerNorm: closed-form (f, 2, 2) x (f, 2)
+            mvp_w = mat[:, 0, 0] * vec_weight + mat[:, 0, 1] * vec_bias
+            mvp_b = mat[:, 1, 0] * vec_weight + mat[:, 1, 1] * vec_bias
         else:
-            v = torch.hstack([vec_weight, vec_bias.unsqueeze(dim=1)])  # (f_out, f_in+1)
-            v = v.unsqueeze(2)  # (f_out, f_in+1, 1)
-            mvp_wb = torch.matmul(mat, v).squeeze(2)  # (f_out, f_in+1)
+            f_out = vec_weight.shape[0]
+            v = get_buffer(self._buffers, 'v', (f_out, mat.shape[-1], 1), mat)  # (f_out, f_in+1, 1)
+            v[:, :-1, 0] = vec_weight.reshape(f_out, -1)
+            v[:, -1, 0] = vec_bias
+            if inplace:
+                # the result is copied into vec_weight and vec_bias, so the output buffer can be reused
+                mvp_wb = torch.matmul(mat, v, out=get_buffer(self._buffers, 'mvp_wb', v.shape, mat))
+            else:
+                mvp_wb = torch.matmul(mat, v)
+            mvp_wb = mvp_wb.squeeze(2)  # (f_out, f_in+1)
             mvp_w = mvp_wb[:, :-1]
             mvp_b = mvp_wb[:, -1]
 
         if inplace:
             vec_weight.copy_(mvp_w)
             vec_bias.copy_(mvp_b)
+            # not mvp_w/mvp_b, which can be views of the reused output buffer
+            return vec_weight, vec_bias
         return mvp_w, mvp_b
 
 
@@ -745,16 +990,19 @@ class Diag:
         return Diag(weight=weight, bias=bias)
 
     def __iadd__(self, other):
+        return self.add_(other)
+
+    def add_(self, other, alpha=1):
         if other.has_weight:
             if self.has_weight:
-                self.weight.add_(other.weight)
+                self.weight.add_(other.weight, alpha=alpha)
             else:
-                self.weight = other.weight
+                self.weight = other.weight if alpha == 1 else other.weight.mul_(alpha)
         if other.has_bias:
             if self.has_bias:
-                self.bias.add_(other.bias)
+                self.bias.add_(other.bias, alpha=alpha)
             else:
-                self.bias = other.bias
+                self.bias = other.bias if alpha == 1 else other.bias.mul_(alpha)
         return self
 
     @property
@@ -792,28 +1040,25 @@ class Diag:
         eig = torch.cat(eig)
         return torch.sort(eig, descending=True)[0]
 
-    def top_eigenvalue(self):
-        top = -1
-        if self.has_weight:
-            top = max(top, self.weight.max().item())
-        if self.has_bias:
-            top = max(top, self.bias.max().item())
-        return top
+    def top_eigenvalue(self, as_scalar=False):
+        if len(self.data) == 0:
+            return -1.  # no tensor to take the device from
+        top = torch.stack([d.max() for d in self.data]).max().clamp(min=-1)
+        return _to_scalar(top, as_scalar)
 
-    def trace(self):
-        trace = 0
-        if self.has_weight:
-            trace += self.weight.sum().item()
-        if self.has_bias:
-            trace += self.bias.sum().item()
-        return trace
+    def trace(self, as_scalar=False):
+        if len(self.data) == 0:
+            return 0.
+        trace = torch.stack([d.sum() for d in self.data]).sum()
+        return _to_scalar(trace, as_scalar)
 
     def save(self, root, relative_dir):
         relative_paths = {}
-        for name in ['weight', 'bias']:
-            mat = getattr(self, name, None)
-            if mat is None:
-                continue
+        # issue the device-to-host copies of weight and bias before waiting on either
+        mats = {name: _to_host(getattr(self, name))
+                for name in ['weight', 'bias'] if getattr(self, name, None) is not None}
+        _wait_host([getattr(self, name) for name in mats])
+        for name, mat in mats.items():
             relative_path = os.path.join(relative_dir, 'diag', f'{name}.npy')
             absolute_path = os.path.join(root, relative_path)
             _save_as_numpy(absolute_path, mat)
@@ -827,23 +1072,16 @@ class Diag:
         if b_path:
             self.bias = _load_from_numpy(b_path, device)
 
-    def to_matrices(self, unflatten, pointer):
-        if self.has_weight:
-            pointer = unflatten(self.weight, pointer)
-        if self.has_bias:
-            pointer = unflatten(self.bias, pointer)
-        return pointer
-
     def update_inv(self, damping=_default_damping, replace=False):
         if self.has_weight:
             if not torch.all(self.weight == 0):
-                self.weight_inv = 1 / (self.weight + damping)
+                self.weight_inv = (self.weight + damping).reciprocal_()
                 if replace:
                     del self.weight
                     self.weight = None
         if self.has_bias:
             if not torch.all(self.bias == 0):
-                self.bias_inv = 1 / (self.bias + damping)
+                self.bias_inv = (self.bias + damping).reciprocal_()
                 if replace:
                     del self.bias
                     self.bias = None
@@ -867,3 +1105,73 @@ class Diag:
                 mvp_b = vec_bias.mul(mat_b)
             rst.append(mvp_b)
         return rst
+
+
+def batched_update_inv(sym_matrices: List[SymMatrix], damping=_default_damping, replace=False,
+                       keep_cholesky=False):
+    """
+    Same as calling sm.update_inv(damping, replace=replace) for each SymMatrix,
+    but square matrices (data, Kron A and B) of the same size, dtype, and device
+    are stacked and inverted by one batched cholesky_ex + cholesky_inverse,
+    and UnitWise blocks of the same shape are inverted together.
+    keep_cholesky: if True, the Cholesky factors of Kron A and B are kept (see Kron.update_inv).
+    """
+    factor_groups = defaultdict(list)  # (n, dtype, device) -> [(mat, damping, set_result)]
+    unit_groups = defaultdict(list)  # (block shape, dtype, device) -> [UnitWise]
+
+    def add_factor(mat, factor_damping, set_result):
+        if not torch.all(mat == 0):
+            factor_groups[(mat.shape[-1], mat.dtype, mat.device)].append((mat, factor_damping, set_result))
+
+    def set_data_inv(sm):
+        def set_result(inv, L):
+            sm.inv = inv
+            if replace:
+                sm.data = None
+        return set_result
+
+    def set_kron_inv(kron, name):
+        def set_result(inv, L):
+            setattr(kron, f'{name}_inv', inv)
+            setattr(kron, f'L_{name}', L if keep_cholesky else None)
+            if replace:
+                setattr(kron, name, None)
+        return set_result
+
+    for sm in sym_matrices:
+        if sm.has_data:
+            add_factor(sm.data, damping, set_data_inv(sm))
+        if sm.has_kron:
+            kron = sm.kron
+            if kron.has_A and kron.has_B and kron.A_is_square and kron.B_is_square:
+                damping_A, damping_B = kron.get_damping(damping)
+                add_factor(kron.A, damping_A, set_kron_inv(kron, 'A'))
+                add_factor(kron.B, damping_B, set_kron_inv(kron, 'B'))
+            else:
+                kron.update_inv(damping, replace=replace, keep_cholesky=keep_cholesky)
+        if sm.has_diag:
+            sm.diag.update_inv(damping, replace=replace)
+        if sm.has_unit:
+            unit = sm.unit
+            if not unit.has_data:
+                raise ValueError('data do not exist.')
+            if not torch.all(unit.data == 0):
+                unit_groups[(unit.data.shape[1:], unit.data.dtype, unit.data.device)].append(unit)
+
+    for (_, dtype, device), group in factor_groups.items():
+        mats = torch.stack([mat for mat, _, _ in group])  # (L, n, n), a copy: damping is added in-place
+        dampings = torch.tensor([float(d) for _, d, _ in group], dtype=dtype, device=device)
+        mats.diagonal(dim1=-2, dim2=-1).add_(dampings.unsqueeze(-1))
+        L, info = torch.linalg.cholesky_ex(mats)
+        check_cholesky_info(info)  # one host sync per group
+        invs = torch.cholesky_inverse(L)
+        for i, (_, _, set_result) in enumerate(group):
+            set_result(invs[i], L[i])
+
+    for group in unit_groups.values():
+        sizes = [unit.data.shape[0] for unit in group]
+        invs = unit_wise_inv(torch.cat([unit.data for unit in group]), damping)
+        for unit, inv in zip(group, invs.split(sizes)):
+            unit.inv = inv
+            if replace:
+                unit.data = None
@@ -1,4 +1,5 @@
 from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional, Sequence
 
 import torch
 from torch import nn
@@ -6,14 +7,22 @@ from torch.nn import functional as F
 from torch.utils.data import BatchSampler, Subset, DataLoader
 from torch.cuda import nvtx
 
+try:
+    import numba
+    _is_numba_available = True
+except ImportError:
+    numba = None
+    _is_numba_available = False
+
 torch_function_class = F.cross_entropy.__class__
 
 _REQUIRES_GRAD_ATTR = '_original_requires_grad'
+_LinAlgError = getattr(torch.linalg, 'LinAlgError', RuntimeError)
 
 __all__ = [
     'original_requires_grad', 'record_original_requires_grad',
     'restore_original_requires_grad', 'skip_param_grad', 'im2col_2d',
-    'im2col_2d_slow', 'cholesky_inv', 'cholesky_solve', 'smw_inv',
+    'im2col_2d_slow', 'get_buffer', 'check_cholesky_info', 'damped_cholesky', 'cholesky_inv', 'unit_wise_inv', 'cholesky_solve', 'smw_inv',
     'PseudoBatchLoaderGenerator', 'nvtx_range', 'has_reduction'
 ]
 
@@ -88,19 +97,79 @@ def im2col_2d_slow(x: torch.Tensor, conv2d: nn.Module):
     return Mx
 
 
-def cholesky_inv(X, damping=1e-7):
-    diag = torch.diagonal(X)
+def get_buffer(buffers: Optional[Dict[str, torch.Tensor]], key: str,
+               shape: Sequence[int], like: torch.Tensor) -> torch.Tensor:
+    """
+    Get buffers[key] if it has the shape and the dtype/device of like,
+    otherwise allocate a new (uninitialized) one and store it in buffers.
+    If buffers is None, a temporary is returned.
+    """
+    shape = torch.Size(shape)
+    if buffers is None:
+        return torch.empty(shape, dtype=like.dtype, device=like.device)
+    buf = buffers.get(key, None)
+    if buf is None or buf.shape != shape or buf.dtype != like.dtype or buf.device != like.device:
+        buf = buffers[key] = torch.empty(shape, dtype=like.dtype, device=like.device)
+    return buf
+
+
+def check_cholesky_info(info: torch.Tensor):
+    """
+    Raise LinAlgError if any factorization by torch.linalg.cholesky_ex failed
+    (a single host sync for the whole batch).
+    """
+    if info.any():
+        msg = 'Cholesky decomposition failed (the input is not positive-definite)'
+        if info.ndim > 0:
+            msg += f' for batch element(s) {torch.nonzero(info.reshape(-1)).flatten().tolist()}'
+        raise _LinAlgError(msg + '.')
+
+
+def damped_cholesky(X, damping=1e-7):
+    # damping is added to (and removed from) a diagonal view of X in-place,
+    # so no damped copy of X is allocated. X can be a batch of matrices.
+    # cholesky_ex + one check of info for the whole batch (after X is restored)
+    diag = torch.diagonal(X, dim1=-2, dim2=-1)
     diag += damping
-    u = torch.linalg.cholesky(X)
+    u, info = torch.linalg.cholesky_ex(X)
     diag -= damping
+    check_cholesky_info(info)
+    return u
+
+
+def cholesky_inv(X, damping=1e-7):
+    u = damped_cholesky(X, damping)
     return torch.cholesky_inverse(u)
 
 
-def cholesky_solve(X, b, damping=1e-7):
-    diag = torch.diagonal(X)
+def unit_wise_inv(X, damping=1e-7):
+    # X: (f, 2, 2) for BatchNormNd/LayerNorm or (f_out, f_in+1, f_in+1)
+    if X.shape[-1] == 2:
+        # closed-form inverse of 2x2 blocks (damping is not written into X)
+        a = X[:, 0, 0] + damping
+        b = X[:, 0, 1]
+        c = X[:, 1, 0]
+        d = X[:, 1, 1] + damping
+        det = a * d - b * c
+        inv = torch.stack([torch.stack([d, -b], dim=-1),
+                           torch.stack([-c, a], dim=-1)], dim=-2)
+        return inv.div_(det[:, None, None])
+    diag = torch.diagonal(X, dim1=-2, dim2=-1)
     diag += damping
-    u = torch.linalg.cholesky(X)
+    L, info = torch.linalg.cholesky_ex(X)
+    failed = info != 0
+    # identity as a placeholder for the factors that failed (overwritten below)
+    eye = torch.eye(X.shape[-1], dtype=X.dtype, device=X.device)
+    inv = torch.cholesky_inverse(torch.where(failed[:, None, None], eye, L))
+    if failed.any():
+        # e.g., rank-deficient blocks (batch size < f_in+1) with a small damping
+        inv[failed] = torch.linalg.inv(X[failed])
     diag -= damping
+    return inv
+
+
+def cholesky_solve(X, b, damping=1e-7):
+    u = damped_cholesky(X, damping)
     return torch.cholesky_solve(b, u)
 
 
@@ -133,3 +133,12 @@ def sequence_data(batch_size, seq_len, in_dim, out_dim):
     x = torch.randn(batch_size, seq_len, in_dim)
     t = torch.randint(-1, out_dim, (batch_size, seq_len))  # -1 for ignore_index
     return x, t
+
+
+@pytest.fixture
+def random_spd():
+    def _random_spd(dim, generator):
+        # well-conditioned symmetric positive definite matrix (dim x dim) in float64
+        x = torch.randn(dim, dim * 2, dtype=torch.float64, generator=generator)
+        return x @ x.T / dim + torch.eye(dim, dtype=torch.float64)
+    return _random_spd
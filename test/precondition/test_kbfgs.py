@@ -0,0 +1,137 @@
+import pytest
+
+import torch
+from asdl import KronBfgsGradientMaker, PreconditioningConfig, LOSS_CROSS_ENTROPY
+from asdl.precondition.kbfgs import powell_lm_damping_, bfgs_inv_update_
+from asdl.precondition.kbfgs import powell_lm_damping_batched_, bfgs_inv_update_batched_
+
+
+def _random_pair(dim, generator):
+    # s^ty > 0 (curvature condition)
+    s = torch.randn(dim, dtype=torch.float64, generator=generator)
+    y = s + 0.1 * torch.randn(dim, dtype=torch.float64, generator=generator)
+    return s, y
+
+
+def _bfgs_inv_update_explicit(H, s, y):
+    # H_new = (I - rho s y^t) H (I - rho y s^t) + rho s s^t, rho = 1 / s^ty
+    rho = 1 / torch.dot(s, y)
+    eye = torch.eye(H.shape[0], dtype=H.dtype)
+    return (eye - rho * torch.outer(s, y)) @ H @ (eye - rho * torch.outer(y, s)) + rho * torch.outer(s, s)
+
+
+@pytest.mark.parametrize('dim', [1, 5])
+@pytest.mark.parametrize('use_workspace', [False, True])
+def test_bfgs_inv_update(random_spd, dim, use_workspace):
+    generator = torch.Generator().manual_seed(0)
+    H = random_spd(dim, generator)
+    s, y = _random_pair(dim, generator)
+    H_true = _bfgs_inv_update_explicit(H, s, y)
+
+    workspace = {} if use_workspace else None
+    for _ in range(2):  # second call reuses the workspace buffers
+        H_test = H.clone()
+        bfgs_inv_update_(H_test, s.clone(), y.clone(), workspace=workspace)
+        torch.testing.assert_close(H_test, H_true)
+
+    # secant condition: H_new y = s
+    torch.testing.assert_close(H_test @ y, s)
+
+
+def _assert_powell_lm_damping(H, s, y, s_damped, y_damped, mu1, mu2):
+    Hy = H @ y
+    # Powell's damping: s~ = theta s + (1 - theta) Hy with s~^ty >= mu1 y^tHy
+    assert torch.dot(s_damped, y) >= mu1 * torch.dot(y, Hy) * (1 - 1e-8)
+    # Levenberg-Marquardt damping: y~ = y + mu2 s~
+    torch.testing.assert_close(y_damped, y + mu2 * s_damped)
+    # the BFGS inverse update with the damped pair keeps H positive definite
+    H_new = H.clone()
+    bfgs_inv_update_(H_new, s_damped.clone(), y_damped.clone())
+    assert torch.linalg.eigvalsh(H_new).min() > 0
+
+
+@pytest.mark.parametrize('dim', [1, 5])
+@pytest.mark.parametrize('seed', range(5))
+def test_powell_lm_damping(random_spd, dim, seed):
+    generator = torch.Generator().manual_seed(seed)
+    mu1, mu2 = 0.2, 0.1
+    H = random_spd(dim, generator)
+    # random pairs, most of which violate the curvature condition so that Powell's damping is active
+    s = torch.randn(dim, dtype=torch.float64, generator=generator)
+    y = torch.randn(dim, dtype=torch.float64, generator=generator)
+    s_test, y_test = s.clone(), y.clone()
+    powell_lm_damping_(H, s_test, y_test, mu1, mu2, workspace={})
+    _assert_powell_lm_damping(H, s, y, s_test, y_test, mu1, mu2)
+
+
+@pytest.mark.parametrize('dim', [1, 5])
+@pytest.mark.parametrize('batch_size', [1, 3])
+def test_bfgs_inv_update_batched(random_spd, dim, batch_size):
+    generator = torch.Generator().manual_seed(0)
+    Hs = [random_spd(dim, generator) for _ in range(batch_size)]
+    pairs = [_random_pair(dim, generator) for _ in range(batch_size)]
+
+    H = torch.stack(Hs)
+    s = torch.stack([s for s, _ in pairs])
+    y = torch.stack([y for _, y in pairs])
+    bfgs_inv_update_batched_(H, s, y)
+
+    for i in range(batch_size):
+        H_true = Hs[i].clone()
+        bfgs_inv_update_(H_true, pairs[i][0].clone(), pairs[i][1].clone())
+        torch.testing.assert_close(H[i], H_true)
+
+
+@pytest.mark.parametrize('dim', [1, 5])
+@pytest.mark.parametrize('batch_size', [1, 3])
+def test_powell_lm_damping_batched(random_spd, dim, batch_size):
+    generator = torch.Generator().manual_seed(0)
+    mu1, mu2 = 0.2, 0.1
+    Hs = [random_spd(dim, generator) for _ in range(batch_size)]
+    # include pairs that violate the curvature condition so that Powell's damping is active
+    pairs = [(torch.randn(dim, dtype=torch.float64, generator=generator),
+              torch.randn(dim, dtype=torch.float64, generator=generator)) for _ in range(batch_size)]
+
+    H = torch.stack(Hs)
+    s = torch.stack([s for s, _ in pairs])
+    y = torch.stack([y for _, y in pairs])
+    powell_lm_damping_batched_(H, s, y, mu1, torch.full((batch_size,), mu2, dtype=torch.float64))
+
+    for i in range(batch_size):
+        s_true, y_true = pairs[i][0].clone(), pairs[i][1].clone()
+        powell_lm_damping_(Hs[i], s_true, y_true, mu1, mu2)
+        torch.testing.assert_close(s[i], s_true)
+        torch.testing.assert_close(y[i], y_true)
+        _assert_powell_lm_damping(Hs[i], pairs[i][0], pairs[i][1], s[i], y[i], mu1, mu2)
+
+
+def _assert_spd(H):
+    torch.testing.assert_close(H, H.T)
+    assert torch.linalg.eigvalsh(H).min() > 0
+
+
+
+@pytest.mark.parametrize('network_type', ['mlp', 'cnn'])
+@pytest.mark.parametrize('in_dim, hid_dim, out_dim, batch_size', [(4, 8, 3, 16)])
+@pytest.mark.parametrize('loss_type', [LOSS_CROSS_ENTROPY])
+@pytest.mark.parametrize('minibatch_hessian_action', [False, True])
+def test_kbfgs_steps(model, loss_fn, multi_data, batch_size, minibatch_hessian_action):
+    model = model.double()
+    x, t = multi_data
+    x = x.double()
+    config = PreconditioningConfig(data_size=batch_size, damping=1e-2, ema_decay=0.1)
+    grad_maker = KronBfgsGradientMaker(model, config, minibatch_hessian_action=minibatch_hessian_action)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.01)
+
+    for _ in range(5):
+        optimizer.zero_grad()
+        dummy_y = grad_maker.setup_model_call(model, x)
+        grad_maker.setup_loss_call(loss_fn, dummy_y, t)
+        grad_maker.forward_and_backward()
+        optimizer.step()
+        # A_inv and B_inv stay symmetric positive definite across the BFGS updates
+        for module in grad_maker.module_dict.values():
+            kron = module.bfgs.kron
+            _assert_spd(kron.A_inv)
+            if kron.B_inv is not None:
+                _assert_spd(kron.B_inv)
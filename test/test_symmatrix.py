@@ -0,0 +1,150 @@
+import copy
+
+import pytest
+
+import torch
+from asdl.symmatrix import SymMatrix, Kron, UnitWise, batched_update_inv
+from asdl.symmatrix import matrix_to_tril, tril_to_matrix, get_n_cols_by_tril
+from asdl.symmatrix import _tril_indices, _use_numba
+
+
+def _random_sym_matrices(random_spd, generator):
+    # full, Kron (same-size factors across layers), and UnitWise, so batched_update_inv stacks them
+    unit_data = torch.stack([random_spd(2, generator) for _ in range(4)])
+    return [
+        SymMatrix(data=random_spd(6, generator)),
+        SymMatrix(kron_A=random_spd(3, generator), kron_B=random_spd(4, generator)),
+        SymMatrix(kron_A=random_spd(4, generator), kron_B=random_spd(3, generator)),
+        SymMatrix(unit_data=unit_data),
+        SymMatrix(unit_data=torch.stack([random_spd(3, generator) for _ in range(2)])),
+    ]
+
+
+@pytest.mark.parametrize('replace', [False, True])
+@pytest.mark.parametrize('keep_cholesky', [False, True])
+def test_batched_update_inv(random_spd, replace, keep_cholesky):
+    generator = torch.Generator().manual_seed(0)
+    damping = 1e-2
+    sms_true = _random_sym_matrices(random_spd, generator)
+    sms_test = copy.deepcopy(sms_true)
+
+    for sm in sms_true:
+        if sm.has_kron:
+            sm.kron.update_inv(damping, replace=replace, keep_cholesky=keep_cholesky)
+        else:
+            sm.update_inv(damping, replace=replace)
+    batched_update_inv(sms_test, damping, replace=replace, keep_cholesky=keep_cholesky)
+
+    for sm_true, sm_test in zip(sms_true, sms_test):
+        if sm_true.has_data or sm_true.inv is not None:
+            torch.testing.assert_close(sm_test.inv, sm_true.inv)
+            assert sm_test.has_data != replace
+        if sm_true.has_kron:
+            torch.testing.assert_close(sm_test.kron.A_inv, sm_true.kron.A_inv)
+            torch.testing.assert_close(sm_test.kron.B_inv, sm_true.kron.B_inv)
+            assert sm_test.kron.has_A != replace
+            assert sm_test.kron.has_B != replace
+            for name in ['L_A', 'L_B']:
+                L_true = getattr(sm_true.kron, name)
+                L_test = getattr(sm_test.kron, name)
+                if keep_cholesky:
+                    torch.testing.assert_close(L_test, L_true)
+                else:
+                    assert L_test is None
+        if sm_true.has_unit:
+            torch.testing.assert_close(sm_test.unit.inv, sm_true.unit.inv)
+            assert sm_test.unit.has_data != replace
+
+
+def test_batched_update_inv_not_positive_definite():
+    A = -torch.eye(3, dtype=torch.float64)
+    sm = SymMatrix(kron_A=A, kron_B=torch.eye(3, dtype=torch.float64))
+    with pytest.raises(RuntimeError):
+        batched_update_inv([sm], damping=1e-5)
+
+
+@pytest.mark.parametrize('k', [1, 5, 12, 20])
+def test_kron_top_k_eigenvalues(random_spd, k):
+    generator = torch.Generator().manual_seed(0)
+    kron = Kron(random_spd(3, generator), random_spd(4, generator))
+    eig_true = torch.linalg.eigvalsh(torch.kron(kron.A, kron.B))
+    eig_true = torch.sort(eig_true, descending=True)[0][:k]
+    torch.testing.assert_close(kron.top_k_eigenvalues(k), eig_true)
+
+
+@pytest.mark.parametrize('bias', [False, True])
+def test_kron_cholesky_solve(random_spd, bias):
+    generator = torch.Generator().manual_seed(0)
+    kron = Kron(random_spd(3, generator), random_spd(4, generator))
+    damping = 1e-2
+    kron.update_inv(damping, keep_cholesky=True)
+    damping_A, damping_B = kron.get_damping(damping)
+    A = kron.A + damping_A * torch.eye(3, dtype=torch.float64)
+    B = kron.B + damping_B * torch.eye(4, dtype=torch.float64)
+
+    vec_weight = torch.randn(4, 3, dtype=torch.float64, generator=generator)
+    vec_bias = torch.randn(4, dtype=torch.float64, generator=generator)
+    if bias:
+        sol_w, sol_b = kron.cholesky_solve(vec_weight, vec_bias)
+        torch.testing.assert_close(sol_b, torch.linalg.solve(B, vec_bias))
+    else:
+        sol_w = kron.cholesky_solve(vec_weight)
+    torch.testing.assert_close(sol_w, torch.linalg.solve(B, vec_weight) @ torch.linalg.inv(A))
+    # agrees with the explicit inverses from the same update_inv call
+    torch.testing.assert_close(sol_w, kron.mvp(vec_weight, use_inv=True))
+
+
+def test_kron_cholesky_solve_without_factors(random_spd):
+    generator = torch.Generator().manual_seed(0)
+    kron = Kron(random_spd(3, generator), random_spd(4, generator))
+    kron.update_inv(1e-2)
+    with pytest.raises(ValueError):
+        kron.cholesky_solve(torch.zeros(4, 3, dtype=torch.float64))
+
+
+def test_add_out(random_spd):
+    generator = torch.Generator().manual_seed(0)
+    sm1, sm2, out = [SymMatrix(data=random_spd(5, generator),
+                               kron_A=random_spd(3, generator), kron_B=random_spd(4, generator),
+                               unit_data=torch.stack([random_spd(2, generator) for _ in range(4)]))
+                     for _ in range(3)]
+    out_data = out.data
+    rst = sm1.add_out(sm2, out)
+    assert rst is out
+    assert out.data is out_data  # written into the existing tensors
+    sm_true = sm1 + sm2
+    torch.testing.assert_close(out.data, sm_true.data)
+    torch.testing.assert_close(out.kron.A, sm_true.kron.A)
+    torch.testing.assert_close(out.kron.B, sm_true.kron.B)
+    torch.testing.assert_close(out.unit.data, sm_true.unit.data)
+
+
+def test_add_out_mismatch(random_spd):
+    generator = torch.Generator().manual_seed(0)
+    sm1 = SymMatrix(data=random_spd(5, generator))
+    with pytest.raises(ValueError):
+        sm1.add_out(SymMatrix(data=random_spd(4, generator)), SymMatrix(data=random_spd(5, generator)))
+    with pytest.raises(ValueError):
+        sm1.add_out(SymMatrix(unit=UnitWise(random_spd(2, generator).unsqueeze(0))),
+                    SymMatrix(data=random_spd(5, generator)))
+
+
+@pytest.mark.parametrize('n', [1, 2, 7])
+@pytest.mark.parametrize('dtype', [torch.float32, torch.float64])
+def test_tril_numba(random_spd, n, dtype):
+    if not _use_numba(torch.zeros(1, dtype=dtype)):
+        pytest.skip('numba is not available.')
+    generator = torch.Generator().manual_seed(0)
+    mat = random_spd(n, generator).to(dtype)
+    rows, cols = _tril_indices(n, n, mat.device)
+
+    tril = matrix_to_tril(mat)
+    torch.testing.assert_close(tril, mat[rows, cols])
+    assert get_n_cols_by_tril(tril) == n
+
+    mat_test = tril_to_matrix(tril)
+    torch.testing.assert_close(mat_test, mat)  # round trip
+    mat_true = torch.zeros_like(mat)
+    mat_true[rows, cols] = tril
+    mat_true[cols, rows] = tril
+    torch.testing.assert_close(mat_test, mat_true)